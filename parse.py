@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import os
+import mmap
 import argparse
-import textwrap
-from pathlib import Path
-from collections.abc import MutableSequence
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 
 """
 Parse TBFSBS (Text-Based Format for Storing Biological Sequences):
@@ -23,6 +24,13 @@ Header format:
 
 """
 
+# Line break characters removed from sequences
+_NEWLINES = b"\r\n"
+
+# Characters a numeric target value can begin with,
+# including those of inf and nan
+_NUMBER_START = frozenset("0123456789-+.iInN")
+
 class TBFSBS_Record():
     """Class representing one sequence in TBFSBS format.
 
@@ -34,6 +42,8 @@ class TBFSBS_Record():
     the sequence length.
     """
 
+    __slots__ = ("identifier", "target_value", "description", "sequence")
+
     def __init__(self, identifier = None, target_value = None,
                 description = None , sequence = None):
         """Initialize class TBFSBS Record.
@@ -50,7 +60,7 @@ class TBFSBS_Record():
             A numeric target value
         description: str
             A description for the record
-        sequence: str
+        sequence: bytes
             The biological sequence
 
         """
@@ -91,37 +101,34 @@ class TBFSBS_Record():
 
         return record_str
 
-class TBFSBS(MutableSequence):
-    """Class representing TBFSBS file sequences.
-    
-    This class represents all sequences in [a]
-    TBFSBS file[s]. The class uses the TBFSBS Record
-    class to represent each sequence in the file[s].
-    """
-
-    def __init__(self):
-        """Initialize class TBFSBS.
+class SequenceLength():
+    """Class representing the length of a sequence.
 
-        This function initialize the TBFSBS object 
-        with a list to store all sequence
-        from the file[s].
+    This class stands in for a sequence that was not
+    stored, keeping only its length. It is used when
+    the sequences are parsed only to print the records.
+    """
 
-        """
+    __slots__ = ("length",)
 
-        super(TBFSBS, self).__init__()
-        self._list = list()
+    def __init__(self, length):
+        self.length = length
 
     def __len__(self):
-        return len(self._list)
+        return self.length
 
-    def __getitem__(self, i):
-        return self._list[i]
+    def __reduce__(self):
+        return (SequenceLength, (self.length,))
 
-    def __delitem__(self, i):
-        del self._list[i]
-
-    def __setitem__(self, i, value):
-        self._list[i] = value
+class TBFSBS(list):
+    """Class representing TBFSBS file sequences.
+    
+    This class represents all sequences in [a]
+    TBFSBS file[s]. The class uses the TBFSBS Record
+    class to represent each sequence in the file[s].
+    The class is a list of TBFSBS records, so appending
+    a record is a direct call to the built-in list.
+    """
 
     def __str__(self):
         """Override representation of the class
@@ -133,72 +140,92 @@ class TBFSBS(MutableSequence):
 
         """
 
-        records_str = ""
-        for record in self._list:
-            records_str += "{RECORD}\n".format(RECORD = record)
-
-        return records_str
+        return "".join("{RECORD}\n".format(RECORD = record)
+                            for record in self)
 
-    def insert(self, i, value):
-        self._list.insert(i, value)
-
-    def append(self, value):
-        self._list.append(value)
-
-    def extend(self, value):
-        self._list.extend(value)
-
-    def parse(self, input_file):
+    def parse(self, input_file, lazy = False):
         """Parse sequences from file.
 
         This function parses sequences from the file.
-        It searches for the line that begins with
-        the % character, which represents the header,
+        The file is memory-mapped and split into records
+        at each line that begins with the % character,
+        which represents the header,
         and parses each part of the header structure
         (identifier, target value, and description)
-        and sequence.
+        and sequence. Sequences are kept as ASCII bytes.
 
         Parameters
         -------------
         input_file: str
             The input file name
+        lazy: bool
+            Store only the sequence lengths
 
         """
 
-        with open(input_file) as tbfsbs_file:
-
-            header = ""
-            for row in tbfsbs_file:
+        with open(input_file, "rb") as tbfsbs_file:
 
-                if row.startswith("%"):
+            # mmap cannot map an empty file
+            if not os.fstat(tbfsbs_file.fileno()).st_size:
+                return
 
-                    if header:
-                        record = TBFSBS_Record(iD,
-                                        target_value,
-                                        description,
-                                        seq)
-                        self.append(record)
+            with mmap.mmap(tbfsbs_file.fileno(), 0,
+                        access = mmap.ACCESS_READ) as data:
 
-                    header = row.split()
-                    iD = header[1]
-
-                    try:
-                        target_value = float(header[2])
-                        description = " ".join(header[3:])
-                    except:
-                        target_value = None
-                        description = " ".join(header[2:])
-
-                    seq = ""
-                    
+                # Every record starts with a % at the beginning
+                # of a line, so records are delimited by "\n%"
+                size = len(data)
+                find = data.find
+                append = self.append
+                if data[:1] == b"%":
+                    start = 0
                 else:
-                    seq += row.rstrip()
-            else:
-                record = TBFSBS_Record(iD,
-                                target_value,
-                                description,
-                                seq)
-                self.append(record)
+                    start = find(b"\n%") + 1 or size
+
+                while start < size:
+
+                    end = find(b"\n%", start)
+                    if end == -1:
+                        end = size
+
+                    # Slice header and sequence straight from the map
+                    # instead of copying the whole record first
+                    header_end = find(b"\n", start, end)
+                    if header_end == -1:
+                        header_end = end
+
+                    header = data[start + 1:header_end].decode(
+                                        "utf-8", "replace").split(None, 1)
+                    iD = header[0] if header else ""
+                    description = header[1].rstrip() if header[1:] else ""
+
+                    # Only try to convert tokens that look like a number
+                    target_value = None
+                    if description[:1] in _NUMBER_START:
+                        value = description.split(None, 1)
+                        try:
+                            target_value = float(value[0])
+                            description = value[1] if value[1:] else ""
+                        except ValueError:
+                            pass
+
+                    # In lazy mode the slice is only counted, not kept
+                    seq = data[header_end + 1:end]
+                    if lazy:
+                        length = len(seq) - seq.count(b"\n")
+                        if b"\r" in seq:
+                            length -= seq.count(b"\r")
+                        seq = SequenceLength(length)
+                    else:
+                        seq = seq.translate(None, _NEWLINES)
+
+                    record = TBFSBS_Record(iD,
+                                    target_value,
+                                    description,
+                                    seq)
+                    append(record)
+
+                    start = end + 1
 
     def write(self, output_file, wrap):
         """Write sequences to a file.
@@ -211,33 +238,120 @@ class TBFSBS(MutableSequence):
 
         Parameters
         -------------
-        output_file: str
-            The output file name
+        output_file: file
+            The output file opened in binary mode
         wrap: int
             Maximum length of the sequence line
 
         """
 
-        records_str = ""
-        for record in self._list:
+        # Records are written one at a time and joined by a
+        # newline, leaving no newline after the last record
+        separator = b""
+        for record in self:
+
+            if isinstance(record.sequence, SequenceLength):
+                raise ValueError("record {ID} was parsed with lazy = True"
+                                " and has no sequence to write".format(
+                                    ID = record.identifier))
 
             value = ""
             if record.target_value:
                 value = "{TARGET_VALUE} ".format(
                             TARGET_VALUE = record.target_value)
 
-            records_str += "% {ID} {TARGET_VALUE}"\
-                        "{DESCRIPTION}\n{SEQUENCE}\n".format(
+            output_file.write(separator)
+            output_file.write("% {ID} {TARGET_VALUE}"\
+                        "{DESCRIPTION}\n".format(
                             ID = record.identifier,
                             TARGET_VALUE = value,
-                            DESCRIPTION = record.description,
-                            SEQUENCE = textwrap.fill(
-                                        record.sequence, wrap))
-        
-        output_file.write(records_str[:-1])
+                            DESCRIPTION = record.description).encode(
+                                            "utf-8"))
+            output_file.write(wrapSequence(record.sequence, wrap))
+
+            separator = b"\n"
                 
 
 
+def wrapSequence(sequence, wrap):
+    """Wrap a sequence into lines
+
+    This function splits the sequence into lines of
+    at most wrap characters by slicing, since a
+    sequence has no words to break on.
+
+    Parameters
+    -------------
+    sequence: bytes
+        The biological sequence
+    wrap: int
+        Maximum length of the sequence line
+
+    Returns
+    -------------
+    wrapped: bytes
+        The sequence with a newline every wrap characters
+    """
+
+    if wrap < 1:
+        raise ValueError("invalid width {WRAP} (must be > 0)".format(
+                            WRAP = wrap))
+
+    if wrap >= len(sequence):
+        return sequence
+
+    return b"\n".join(sequence[i:i + wrap]
+                    for i in range(0, len(sequence), wrap))
+
+def walkFolder(folder):
+    """Walk a folder for files
+
+    This function yields the path of every file in the
+    folder and its subfolders. It uses os.scandir, whose
+    entries know their own type without an extra stat.
+
+    Parameters
+    -------------
+    folder: str
+        The folder name
+
+    Yields
+    -------------
+    path: str
+        Path of a file in the folder
+    """
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks = False):
+                yield from walkFolder(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+def parseFile(input_file, lazy = False):
+    """Parse one TBFSBS file
+
+    This function parses one file into a new TBFSBS
+    object, so files can be parsed in worker processes.
+
+    Parameters
+    -------------
+    input_file: str
+        The input file name
+    lazy: bool
+        Store only the sequence lengths
+
+    Returns
+    -------------
+    tbfsbs: TBFSBS
+        TBFSBS object with the sequences from the file
+    """
+
+    tbfsbs = TBFSBS()
+    tbfsbs.parse(input_file, lazy)
+
+    return tbfsbs
+
 def getArguments():
     """Get arguments from terminal
 
@@ -256,14 +370,18 @@ def getArguments():
                     help = "List of input file names or" \
                     " folder[s] with file[s]")
     parser.add_argument("-o", "--output", nargs = "?",
-                    type = argparse.FileType("w"),
+                    type = argparse.FileType("wb", 1 << 20),
                     help = "Output file name.")
     parser.add_argument("-w", "--wrap", nargs = "?",
                     const = float("inf"), type = int,
                     default = float("inf"),
                     help = "Maximum length of the sequence line.")
 
-    return parser.parse_args()
+    arguments = parser.parse_args()
+    if arguments.wrap < 1:
+        parser.error("argument -w/--wrap: must be a positive integer")
+
+    return arguments
 
 
 if __name__ == "__main__":
@@ -272,22 +390,38 @@ if __name__ == "__main__":
     tbfsbs = TBFSBS()
     input_files = args.input_files
 
+    files = []
     for input_file in input_files:
 
         if os.path.isdir(input_file):
-            files = list(Path(input_file).rglob("*"))
-            input_files.extend(files)
+            files.extend(walkFolder(input_file))
             continue
 
+        files.append(input_file)
+
+    # Sequences are only needed to write the output file
+    parse_file = partial(parseFile, lazy = args.output is None)
+
+    # Files are independent, so several files are parsed in
+    # worker processes. A single file, or a single CPU, is
+    # parsed here, since sending the records back from a
+    # worker costs about as much as parsing them
+    cpus = os.cpu_count() or 1
+    parallel = len(files) > 1 and cpus > 1
+    with ProcessPoolExecutor() if parallel else nullcontext() as executor:
+        if parallel:
+            parsed_files = executor.map(parse_file, files,
+                                chunksize = max(1, len(files) // (4 * cpus)))
+        else:
+            parsed_files = map(parse_file, files)
 
-        print("File: {FILE_NAME}\n".format(
-                                FILE_NAME = input_file))
+        for input_file, file in zip(files, parsed_files):
 
-        file = TBFSBS()
-        file.parse(input_file)
-        print(file)
+            print("File: {FILE_NAME}\n".format(
+                                    FILE_NAME = input_file))
+            print(file)
 
-        tbfsbs.extend(file)
+            tbfsbs.extend(file)
 
     if args.output:
-        tbfsbs.write(args.output, args.wrap)
\ No newline at end of file
+        tbfsbs.write(args.output, args.wrap)